@@ -1,946 +1,1328 @@
-import os
-import json
-import pandas as pd
-import streamlit as st
-import matplotlib.pyplot as plt
-import requests
-from datetime import datetime
-
-# ---------------------------
-# Page Configuration & Styling
-# ---------------------------
-st.set_page_config(
-    page_title="AI Lab Compliance Copilot",
-    page_icon="🧪",
-    layout="wide",
-    initial_sidebar_state="expanded",
-)
-
-st.markdown("""
-    <style>
-        .stApp, body { background-color: #f3f4f6; }
-        .block-container { padding-top: 1.5rem; padding-bottom: 2rem; }
-
-        div[data-testid="stChatMessage"] {
-            background: #ffffff !important;
-            border: 1px solid #e5e7eb !important;
-            border-radius: 16px !important;
-            padding: 12px 14px !important;
-            margin-bottom: 10px !important;
-        }
-        div[data-testid="stChatMessage"] p {
-            color: #111827 !important;
-            font-size: 1rem !important;
-            line-height: 1.45 !important;
-        }
-
-        div[data-testid="stChatMessage"] > div:first-child {
-            background-color: #dbeafe !important;
-            border-radius: 50% !important;
-            border: 2px solid #3b82f6 !important;
-            padding: 2px !important;
-        }
-
-        div[data-testid="stChatMessage"][data-kind="user"] > div:first-child {
-            background-color: #dbeafe !important;
-            border: 2px solid #3b82f6 !important;
-        }
-
-        div[data-testid="stChatMessage"][data-kind="assistant"] > div:first-child {
-            background-color: #dcfce7 !important;
-            border: 2px solid #22c55e !important;
-        }
-
-        .stTextArea textarea {
-            background: #ffffff !important;
-            border: 1px solid #e5e7eb !important;
-            border-radius: 12px !important;
-            color: #111827 !important;
-        }
-
-        button[kind="primary"] {
-            background-color: #2563eb !important;
-            color: white !important;
-            border-radius: 10px !important;
-            height: 42px !important;
-            padding: 0 18px !important;
-            font-weight: 600 !important;
-            border: 1px solid #1d4ed8 !important;
-        }
-
-        h1, h2, h3, h4 { color: #111827 !important; }
-
-        .card {
-            border: 1px solid #e5e7eb;
-            background: #ffffff;
-            border-radius: 16px;
-            padding: 14px 16px;
-            margin-bottom: 10px;
-        }
-        
-        .deviation-card {
-            border: 1px solid #e5e7eb;
-            background: #ffffff;
-            border-radius: 12px;
-            padding: 16px;
-            margin-bottom: 12px;
-            box-shadow: 0 2px 4px rgba(0,0,0,0.05);
-        }
-        
-        .critical { border-left: 4px solid #ef4444; }
-        .major { border-left: 4px solid #f59e0b; }
-        .minor { border-left: 4px solid #10b981; }
-        
-        .download-btn {
-            background-color: #10b981 !important;
-            color: white !important;
-            border: none !important;
-            border-radius: 8px !important;
-            padding: 6px 12px !important;
-            font-size: 0.8rem !important;
-        }
-        
-        .sample-question {
-            background: #f8fafc !important;
-            border: 1px solid #e2e8f0 !important;
-            border-radius: 8px !important;
-            padding: 8px 12px !important;
-            margin: 4px 0 !important;
-            cursor: pointer !important;
-            transition: all 0.2s !important;
-        }
-        
-        .sample-question:hover {
-            background: #e2e8f0 !important;
-            border-color: #cbd5e1 !important;
-        }
-        
-        .sop-reference {
-            font-size: 0.8rem;
-            color: #6b7280;
-            font-style: italic;
-            margin-top: 8px;
-            padding: 4px 8px;
-            background: #f3f4f6;
-            border-radius: 4px;
-        }
-        
-        .alert-critical {
-            background: #fef2f2 !important;
-            border: 1px solid #fecaca !important;
-            border-left: 4px solid #ef4444 !important;
-        }
-        
-        .alert-warning {
-            background: #fffbeb !important;
-            border: 1px solid #fed7aa !important;
-            border-left: 4px solid #f59e0b !important;
-        }
-    </style>
-""", unsafe_allow_html=True)
-
-# ---------------------------
-# Backend URL Configuration
-# ---------------------------
-BACKEND_URL = "http://localhost:8000"
-
-# ---------------------------
-# Session State Initialization
-# ---------------------------
-if "history" not in st.session_state:
-    st.session_state["history"] = []
-
-if "clear_input" not in st.session_state:
-    st.session_state["clear_input"] = False
-
-if "deviation_reports" not in st.session_state:
-    st.session_state["deviation_reports"] = []
-
-if "trends_data" not in st.session_state:
-    st.session_state["trends_data"] = None
-
-if "available_sops" not in st.session_state:
-    st.session_state["available_sops"] = []
-
-if "current_query" not in st.session_state:
-    st.session_state["current_query"] = ""
-
-if "query_submitted" not in st.session_state:
-    st.session_state["query_submitted"] = False
-
-if "critical_deviations" not in st.session_state:
-    st.session_state["critical_deviations"] = None
-
-if "compliance_trends" not in st.session_state:
-    st.session_state["compliance_trends"] = None
-
-if "compliance_dashboard" not in st.session_state:
-    st.session_state["compliance_dashboard"] = None
-
-if "recent_alerts" not in st.session_state:
-    st.session_state["recent_alerts"] = None
-
-# ---------------------------
-# Utility Functions
-# ---------------------------
-def check_backend_health():
-    """Check if backend is running"""
-    try:
-        response = requests.get(f"{BACKEND_URL}/health", timeout=5)
-        return response.status_code == 200, response.json() if response.status_code == 200 else None
-    except:
-        return False, None
-
-def upload_sop_file(file):
-    """Upload SOP file to backend"""
-    try:
-        files = {"file": (file.name, file.getvalue(), "application/pdf")}
-        response = requests.post(f"{BACKEND_URL}/upload-sop", files=files)
-        return response.status_code == 200, response.json() if response.status_code == 200 else None
-    except Exception as e:
-        return False, f"Connection error: {e}"
-
-def list_sops():
-    """Get list of available SOPs from backend"""
-    try:
-        response = requests.get(f"{BACKEND_URL}/list-sops")
-        return response.status_code == 200, response.json() if response.status_code == 200 else None
-    except Exception as e:
-        return False, f"Connection error: {e}"
-
-def process_sops():
-    """Process SOPs in backend"""
-    try:
-        response = requests.post(f"{BACKEND_URL}/process")
-        return response.status_code == 200, response.json() if response.status_code == 200 else None
-    except Exception as e:
-        return False, f"Connection error: {e}"
-
-def process_deviation_samples():
-    """Process deviation samples in backend"""
-    try:
-        response = requests.post(f"{BACKEND_URL}/process-deviations")
-        return response.status_code == 200, response.json() if response.status_code == 200 else None
-    except Exception as e:
-        return False, f"Connection error: {e}"
-
-def query_sop(query):
-    """Query SOP system"""
-    try:
-        response = requests.post(f"{BACKEND_URL}/query", data={"query": query})
-        return response.status_code == 200, response.json() if response.status_code == 200 else None
-    except Exception as e:
-        return False, f"Connection error: {e}"
-
-def process_incident(incident_description, generate_pdf=True):
-    """Report incident to backend"""
-    try:
-        response = requests.post(
-            f"{BACKEND_URL}/report-incident",
-            data={"incident": incident_description, "generate_pdf": generate_pdf}
-        )
-        return response.status_code == 200, response.json() if response.status_code == 200 else None
-    except Exception as e:
-        return False, f"Connection error: {e}"
-
-def get_deviation_trends(days=30):
-    """Get deviation trends from backend"""
-    try:
-        response = requests.get(f"{BACKEND_URL}/deviation-trends?days={days}")
-        return response.status_code == 200, response.json() if response.status_code == 200 else None
-    except Exception as e:
-        return False, f"Connection error: {e}"
-
-def get_retraining_suggestions():
-    """Get retraining suggestions from backend"""
-    try:
-        response = requests.get(f"{BACKEND_URL}/retraining-suggestions")
-        return response.status_code == 200, response.json() if response.status_code == 200 else None
-    except Exception as e:
-        return False, f"Connection error: {e}"
-
-def create_structured_deviation(incident_description, severity, category, generate_pdf=True):
-    """Create structured deviation report"""
-    try:
-        response = requests.post(
-            f"{BACKEND_URL}/deviation-prompt",
-            data={
-                "incident_description": incident_description,
-                "severity": severity,
-                "category": category,
-                "generate_pdf": generate_pdf
-            }
-        )
-        return response.status_code == 200, response.json() if response.status_code == 200 else None
-    except Exception as e:
-        return False, f"Connection error: {e}"
-
-def list_reports():
-    """List all generated reports"""
-    try:
-        response = requests.get(f"{BACKEND_URL}/list-reports")
-        return response.status_code == 200, response.json() if response.status_code == 200 else None
-    except Exception as e:
-        return False, f"Connection error: {e}"
-
-def get_critical_deviations():
-    """Get flagged critical deviations"""
-    try:
-        response = requests.get(f"{BACKEND_URL}/flag-critical-deviations")
-        return response.status_code == 200, response.json() if response.status_code == 200 else None
-    except Exception as e:
-        return False, f"Connection error: {e}"
-
-def get_compliance_trends():
-    """Get non-compliance trends"""
-    try:
-        response = requests.get(f"{BACKEND_URL}/compliance-trends")
-        return response.status_code == 200, response.json() if response.status_code == 200 else None
-    except Exception as e:
-        return False, f"Connection error: {e}"
-
-def get_compliance_dashboard():
-    """Get comprehensive compliance dashboard"""
-    try:
-        response = requests.get(f"{BACKEND_URL}/compliance-dashboard")
-        return response.status_code == 200, response.json() if response.status_code == 200 else None
-    except Exception as e:
-        return False, f"Connection error: {e}"
-
-def get_real_time_alerts():
-    """Get real-time compliance alerts"""
-    try:
-        response = requests.get(f"{BACKEND_URL}/real-time-alerts")
-        return response.status_code == 200, response.json() if response.status_code == 200 else None
-    except Exception as e:
-        return False, f"Connection error: {e}"
-
-def set_sample_question(question):
-    """Set sample question in query input"""
-    st.session_state["current_query"] = question
-    st.session_state["query_submitted"] = False
-
-# ---------------------------
-# Sidebar Controls
-# ---------------------------
-with st.sidebar:
-    st.header("⚙️ Data & Settings")
-    
-    # Backend Health Check
-    backend_healthy, health_data = check_backend_health()
-    if backend_healthy:
-        if health_data:
-            st.caption(f"SOP Files: {health_data.get('sop_files_available', 0)}")
-            st.caption(f"Deviation Samples: {health_data.get('deviation_samples_available', 0)}")
-    else:
-        st.error("❌ Backend Not Connected")
-        st.caption("Make sure backend is running on localhost:8000")
-    
-    # Real-time Alerts Section
-    st.markdown("---")
-    st.subheader("🚨 Real-time Alerts")
-    
-    if st.button("🔄 Check Alerts", use_container_width=True, key="check_alerts_btn"):
-        with st.spinner("Checking for critical deviations..."):
-            success, alerts = get_real_time_alerts()
-            if success and alerts.get('alerts_count', 0) > 0:
-                st.session_state["recent_alerts"] = alerts
-                st.warning(f"🚨 {alerts['alerts_count']} critical alerts found!")
-            else:
-                st.session_state["recent_alerts"] = None
-                st.success("✅ No critical alerts")
-    
-    if "recent_alerts" in st.session_state and st.session_state["recent_alerts"]:
-        alerts_data = st.session_state["recent_alerts"]
-        for alert in alerts_data.get('alerts', [])[:3]:  # Show top 3
-            st.error(f"**{alert['title']}**")
-            st.caption(alert['description'][:100] + "...")
-    
-    st.markdown("---")
-    
-    # SOP Management
-    st.subheader("📚 SOP Management")
-    
-    # List available SOPs
-    if st.button("🔄 Refresh SOP List", use_container_width=True, key="refresh_sops_btn"):
-        success, sops_data = list_sops()
-        if success:
-            st.session_state["available_sops"] = sops_data.get("sops", [])
-            st.success(f"Found {len(st.session_state['available_sops'])} SOPs")
-        else:
-            st.error("Failed to load SOPs")
-    
-    if st.session_state["available_sops"]:
-        st.write("**Available SOPs:**")
-        for sop in st.session_state["available_sops"][:5]:  # Show first 5
-            st.caption(f"• {sop}")
-    
-    # SOP Upload
-    uploaded_pdf = st.file_uploader("📄 Upload New SOP PDF", type=["pdf"], key="pdf_up")
-    if uploaded_pdf is not None:
-        with st.spinner(f"Uploading {uploaded_pdf.name}..."):
-            success, result = upload_sop_file(uploaded_pdf)
-            if success:
-                st.success(f"✅ {uploaded_pdf.name} uploaded successfully!")
-                # Refresh SOP list
-                success, sops_data = list_sops()
-                if success:
-                    st.session_state["available_sops"] = sops_data.get("sops", [])
-            else:
-                st.error(f"❌ Upload failed: {result}")
-    
-    # SOP Processing
-    if st.button("📥 Process SOPs", use_container_width=True, key="process_sops_btn"):
-        with st.spinner("Embedding and processing SOP documents..."):
-            success, result = process_sops()
-            if success:
-                st.success("✅ SOPs processed successfully!")
-                # Refresh SOP list
-                success, sops_data = list_sops()
-                if success:
-                    st.session_state["available_sops"] = sops_data.get("sops", [])
-            else:
-                st.error(f"❌ Failed to process SOPs: {result}")
-    
-    st.markdown("---")
-    
-    # Deviation Analysis
-    st.subheader("📊 Deviation Analysis")
-    
-    if st.button("🔄 Process Deviation Samples", use_container_width=True, key="process_deviations_btn"):
-        with st.spinner("Processing deviation samples for trend analysis..."):
-            success, result = process_deviation_samples()
-            if success:
-                st.success("✅ Deviation samples processed successfully!")
-            else:
-                st.error(f"❌ Failed to process deviations: {result}")
-    
-    # Enhanced Compliance Analysis Section
-    st.subheader("🚨 Compliance Monitoring")
-    
-    col1, col2 = st.columns(2)
-    
-    with col1:
-        if st.button("🚩 Flag Critical", use_container_width=True, key="flag_deviations_btn"):
-            with st.spinner("Analyzing for critical deviations..."):
-                success, critical_data = get_critical_deviations()
-                if success:
-                    st.session_state["critical_deviations"] = critical_data
-                    flagged_count = critical_data.get('flagged_count', 0)
-                    if flagged_count > 0:
-                        st.warning(f"🚩 {flagged_count} critical deviations!")
-                    else:
-                        st.success("✅ No critical issues")
-                else:
-                    st.error("Failed to flag deviations")
-    
-    with col2:
-        if st.button("📈 Find Trends", use_container_width=True, key="find_trends_btn"):
-            with st.spinner("Analyzing non-compliance patterns..."):
-                success, trends_data = get_compliance_trends()
-                if success:
-                    st.session_state["compliance_trends"] = trends_data
-                    trends_count = trends_data.get('trends_identified', 0)
-                    if trends_count > 0:
-                        st.info(f"📈 {trends_count} trends found")
-                    else:
-                        st.success("✅ No significant trends")
-                else:
-                    st.error("Failed to analyze trends")
-    
-    if st.button("📋 Generate Dashboard", use_container_width=True, key="generate_dashboard_btn"):
-        with st.spinner("Generating compliance dashboard..."):
-            success, dashboard_data = get_compliance_dashboard()
-            if success:
-                st.session_state["compliance_dashboard"] = dashboard_data
-                st.success("✅ Dashboard generated!")
-            else:
-                st.error("Failed to generate dashboard")
-    
-    # Quick Status Display
-    if "critical_deviations" in st.session_state and st.session_state["critical_deviations"]:
-        critical_data = st.session_state["critical_deviations"]
-        flagged_count = critical_data.get('flagged_count', 0)
-        if flagged_count > 0:
-            st.error(f"**Active Critical Issues:** {flagged_count}")
-    
-    if "compliance_trends" in st.session_state and st.session_state["compliance_trends"]:
-        trends_data = st.session_state["compliance_trends"]
-        trends_count = trends_data.get('trends_identified', 0)
-        if trends_count > 0:
-            st.warning(f"**Active Trends:** {trends_count}")
-    
-    st.markdown("---")
-    
-    # Report Management
-    st.subheader("📋 Reports")
-    if st.button("🔄 Refresh Reports", use_container_width=True, key="refresh_reports_btn"):
-        success, reports = list_reports()
-        if success:
-            st.session_state["available_reports"] = reports
-            st.success("Reports refreshed!")
-        else:
-            st.error("Failed to load reports")
-    
-    # Quick Actions
-    st.subheader("⚡ Quick Actions")
-    
-    col1, col2 = st.columns(2)
-    
-    with col1:
-        if st.button("🔍 Quick Scan", use_container_width=True, key="quick_scan_btn"):
-            with st.spinner("Quick scanning for issues..."):
-                success, critical_data = get_critical_deviations()
-                if success:
-                    flagged_count = critical_data.get('flagged_count', 0)
-                    if flagged_count > 0:
-                        st.error(f"🚨 {flagged_count} critical issues!")
-                    else:
-                        st.success("✅ System clean")
-    
-    with col2:
-        if st.button("📊 Trends Only", use_container_width=True, key="trends_only_btn"):
-            with st.spinner("Checking trends..."):
-                success, trends_data = get_compliance_trends()
-                if success:
-                    trends_count = trends_data.get('trends_identified', 0)
-                    if trends_count > 0:
-                        st.warning(f"📈 {trends_count} patterns found")
-                    else:
-                        st.success("✅ No trends")
-    
-    # System Status
-    st.markdown("---")
-    st.subheader("🔍 System Status")
-    
-    # Show current session state status
-    status_items = []
-    
-    if st.session_state.get("available_sops"):
-        status_items.append(f"📚 SOPs: {len(st.session_state['available_sops'])}")
-    
-    if st.session_state.get("deviation_reports"):
-        status_items.append(f"⚠️ Reports: {len(st.session_state['deviation_reports'])}")
-    
-    if st.session_state.get("critical_deviations"):
-        critical_count = st.session_state["critical_deviations"].get('flagged_count', 0)
-        if critical_count > 0:
-            status_items.append(f"🚨 Critical: {critical_count}")
-    
-    if st.session_state.get("compliance_trends"):
-        trends_count = st.session_state["compliance_trends"].get('trends_identified', 0)
-        if trends_count > 0:
-            status_items.append(f"📈 Trends: {trends_count}")
-    
-    if status_items:
-        st.write("**Current Status:**")
-        for item in status_items:
-            st.caption(item)
-    else:
-        st.caption("No active analysis data")
-    
-    # Clear All Data
-    st.markdown("---")
-    if st.button("🗑️ Clear All Data", use_container_width=True, key="clear_all_btn"):
-        st.session_state["history"] = []
-        st.session_state["deviation_reports"] = []
-        st.session_state["critical_deviations"] = None
-        st.session_state["compliance_trends"] = None
-        st.session_state["compliance_dashboard"] = None
-        st.session_state["recent_alerts"] = None
-        st.session_state["current_query"] = ""
-        st.session_state["query_submitted"] = False
-        st.success("All session data cleared!")
-        st.rerun()
-
-# ---------------------------
-# Main Layout
-# ---------------------------
-st.title("🧪 AI Lab Compliance Copilot")
-
-# Create tabs for different functionalities
-tab1, tab2, tab3, tab4 = st.tabs(["💬 SOP Chat", "⚠️ Report Incident", "📈 Trends & Training", "📊 Compliance Dashboard"])
-
-# ---------------------------
-# Tab 1: SOP Chat Interface
-# ---------------------------
-with tab1:
-    col1, col2 = st.columns([2, 1])
-    
-    with col1:
-        st.subheader("Ask about SOPs")
-        
-        # Display chat history
-        for turn in st.session_state["history"]:
-            with st.chat_message("user"):
-                st.write(turn["q"])
-            with st.chat_message("assistant"):
-                st.write(turn["a"])
-                # Show SOP references as subtle caption
-                if turn.get("references"):
-                    st.markdown(f'<div class="sop-reference">Based on: {", ".join(turn["references"])}</div>', unsafe_allow_html=True)
-        
-        # Handle query submission from sample questions
-        if st.session_state.get("query_submitted", False):
-            query = st.session_state["current_query"]
-            if query.strip():
-                with st.spinner("Searching SOP documents..."):
-                    success, result = query_sop(query)
-                    
-                    if success:
-                        answer_text = result.get("answer", "No answer found.")
-                        references = result.get("sop_references", [])
-                        
-                        # Add to history
-                        st.session_state["history"].append({
-                            "q": query.strip(), 
-                            "a": answer_text,
-                            "references": references
-                        })
-                        
-                        # Reset the flag and clear query
-                        st.session_state["query_submitted"] = False
-                        st.session_state["current_query"] = ""
-                        st.rerun()
-                    else:
-                        st.error(f"Query failed: {result}")
-                        st.session_state["query_submitted"] = False
-        
-        # Chat input - use a different key for the widget
-        query_input = st.text_area(
-            "Ask a question about SOPs, procedures, or compliance...", 
-            height=100, 
-            label_visibility="collapsed", 
-            key="query_input_widget",
-            value=st.session_state["current_query"],
-            placeholder="e.g., What is the temperature limit for FBD? What are the cleaning procedures for compression machines?"
-        )
-        
-        col_btn1, col_btn2 = st.columns([1, 6])
-        with col_btn1:
-            ask_btn = st.button("Submit", type="primary", use_container_width=True, key="submit_query_btn")
-        with col_btn2:
-            clear_btn = st.button("Clear Chat", use_container_width=True, key="clear_chat_btn")
-        
-        if clear_btn:
-            st.session_state["history"] = []
-            st.session_state["current_query"] = ""
-            st.session_state["query_submitted"] = False
-            st.rerun()
-        
-        if ask_btn and query_input.strip():
-            st.session_state["current_query"] = query_input
-            st.session_state["query_submitted"] = True
-            st.rerun()
-    
-    with col2:
-        st.subheader("Quick Actions")
-        
-        st.markdown("---")
-        st.subheader("📋 Sample Questions")
-        
-        sample_questions = [
-            "What is the compression machine pressure limit?",
-            "How to clean a vibro sifter?",
-            "What are the environmental monitoring requirements?",
-            "Procedure for handling deviations",
-            "Temperature limits for fluid bed dryer",
-            "Documentation requirements for batch manufacturing",
-            "Sampling frequency for in-process checks",
-            "Calibration procedure for balances",
-            "Cleaning validation requirements",
-            "Personnel training requirements"
-        ]
-        
-        for question in sample_questions:
-            if st.button(
-                question, 
-                use_container_width=True, 
-                key=f"sample_{hash(question)}"
-            ):
-                set_sample_question(question)
-                st.session_state["query_submitted"] = True
-                st.rerun()
-
-# ---------------------------
-# Tab 2: Incident Reporting
-# ---------------------------
-with tab2:
-    col1, col2 = st.columns([1, 1])
-    
-    with col1:
-        st.subheader("📝 Report New Incident")
-            
-        with st.form("structured_incident_form"):
-            incident_desc = st.text_area("Incident Description:", 
-                                        key="structured_incident",
-                                        placeholder="Brief description of what happened")
-            
-            col1, col2 = st.columns(2)
-            with col1:
-                severity = st.selectbox("Severity Level:", 
-                                        ["minor", "major", "critical"],
-                                        key="severity_select")
-                category = st.selectbox("Category:",
-                                        ["equipment", "process", "documentation", "training", "environmental"],
-                                        key="category_select")
-            
-            with col2:
-                department = st.selectbox("Department:",
-                                        ["Manufacturing", "Quality Control", "Packaging", "Maintenance"],
-                                        key="dept_select")
-                generate_pdf = st.checkbox("Generate PDF Report", value=True, key="structured_pdf")
-            
-            submitted = st.form_submit_button("🚨 Create Deviation Report", type="primary", key="create_deviation_btn")
-            
-            if submitted and incident_desc.strip():
-                with st.spinner("Creating structured deviation report..."):
-                    success, result = create_structured_deviation(incident_desc, severity, category, generate_pdf)
-                    
-                    if success:
-                        st.success("✅ Deviation report created successfully!")
-                        if "report" in result:
-                            st.session_state["deviation_reports"].append(result)
-                            
-                            # Show download button for PDF
-                            report_data = result["report"]
-                            if report_data.get("pdf_report_path"):
-                                pdf_filename = os.path.basename(report_data["pdf_report_path"])
-                                st.download_button(
-                                    label="📄 Download PDF Report",
-                                    data=requests.get(f"{BACKEND_URL}/download-pdf/{pdf_filename}").content,
-                                    file_name=pdf_filename,
-                                    mime="application/pdf",
-                                    use_container_width=True,
-                                    key=f"dl_structured_{pdf_filename}"
-                                )
-
-    with col2:
-        st.subheader("Recent Deviation Reports")
-        
-        if st.session_state["deviation_reports"]:
-            for i, report in enumerate(st.session_state["deviation_reports"][-5:]):
-                deviation_data = report.get("deviation_analysis", {})
-                severity = deviation_data.get("severity_level", "unknown")
-                incident_preview = report.get('incident', 'Unknown incident')[:80] + "..." if len(report.get('incident', '')) > 80 else report.get('incident', 'Unknown incident')
-                
-                st.markdown(f"""
-                <div class="deviation-card {severity}">
-                    <strong>{incident_preview}</strong><br>
-                    <small>Severity: {severity.upper()} | Category: {deviation_data.get('deviation_category', 'unknown')}</small>
-                </div>
-                """, unsafe_allow_html=True)
-        else:
-            st.info("No deviation reports yet. Report an incident to see them here.")
-
-# ---------------------------
-# Tab 3: Trends & Training
-# ---------------------------
-with tab3:
-    col1, col2 = st.columns([1, 1])
-    
-    with col1:
-        st.subheader("📈 Deviation Trends & Flagging")
-        
-        # Quick flagging section
-        st.write("**🚨 Quick Flagging**")
-        
-        if st.button("🔍 Scan for Critical Issues", use_container_width=True, key="scan_critical_btn"):
-            with st.spinner("Scanning for critical deviations..."):
-                success, critical_data = get_critical_deviations()
-                if success:
-                    flagged_count = critical_data.get('flagged_count', 0)
-                    if flagged_count > 0:
-                        st.error(f"🚨 {flagged_count} critical deviations found!")
-                        for deviation in critical_data.get('critical_deviations', [])[:3]:
-                            st.write(f"• {deviation.get('content', '')[:100]}...")
-                    else:
-                        st.success("✅ No critical issues found")
-        
-        # Display quick trends if available
-        if "compliance_trends_quick" in st.session_state:
-            trends_data = st.session_state["compliance_trends_quick"]
-            st.write("**📊 Quick Trends Analysis**")
-            for trend in trends_data.get('compliance_trends', [])[:2]:
-                st.write(f"• {trend.get('pattern', '')}: {trend.get('analysis', {}).get('severity', '')}")
-        
-        # Historical Trends Analysis
-        st.markdown("---")
-        st.subheader("📊 Historical Trends")
-        
-        if st.button("📈 Analyze Historical Trends", use_container_width=True, key="analyze_historical_btn"):
-            with st.spinner("Analyzing historical deviation patterns..."):
-                success, trends = get_deviation_trends(30)
-                if success:
-                    st.session_state["trends_data"] = trends
-                    st.success("Trends analysis completed!")
-                else:
-                    st.error("Failed to analyze trends")
-        
-        if st.session_state["trends_data"]:
-            trends = st.session_state["trends_data"]
-            if "error" not in trends:
-                st.success(f"✅ Analyzed {trends.get('reports_analyzed', 0)} reports")
-                
-                # Display trends analysis
-                st.write("**Trends Summary:**")
-                st.write(trends.get("trends_analysis", "No analysis available"))
-            else:
-                st.error(trends["error"])
-    
-    with col2:
-        st.subheader("🎓 Retraining & SOP Reinforcement")
-        
-        if st.button("🔄 Generate Training Suggestions", use_container_width=True, key="generate_training_btn"):
-            with st.spinner("Analyzing deviations and generating training suggestions..."):
-                success, suggestions = get_retraining_suggestions()
-                
-                if success and "error" not in suggestions:
-                    st.success("✅ Training suggestions generated!")
-                    
-                    # Display suggestions
-                    st.write("**Comprehensive Training Program:**")
-                    st.write(suggestions.get("suggestions", "No specific suggestions available"))
-                    
-                    # Show program details
-                    if suggestions.get("program_id"):
-                        st.caption(f"Program ID: {suggestions['program_id']}")
-                else:
-                    st.error("Failed to generate training suggestions")
-        
-        st.markdown("---")
-        st.subheader("📋 Common Training Needs")
-        
-        training_needs = [
-            "Good Documentation Practices (GDP)",
-            "Equipment Operation & Maintenance",
-            "Environmental Monitoring Procedures",
-            "Deviation Reporting & Investigation",
-            "Root Cause Analysis Techniques",
-            "GMP Compliance Awareness",
-            "Quality Control Testing Methods",
-            "Batch Record Documentation"
-        ]
-        
-        for need in training_needs:
-            st.write(f"• {need}")
-
-# ---------------------------
-# Tab 4: Compliance Dashboard
-# ---------------------------
-with tab4:
-    st.subheader("📊 Real-time Compliance Dashboard")
-    
-    col1, col2, col3, col4 = st.columns(4)
-    
-    with col1:
-        if st.button("🔄 Refresh Dashboard", use_container_width=True, key="refresh_dashboard_btn"):
-            with st.spinner("Updating dashboard..."):
-                success, dashboard_data = get_compliance_dashboard()
-                if success:
-                    st.session_state["compliance_dashboard"] = dashboard_data
-                    st.rerun()
-    
-    # Display Dashboard Data
-    # Display Dashboard Data
-if "compliance_dashboard" in st.session_state and st.session_state["compliance_dashboard"] is not None:
-    dashboard_data = st.session_state["compliance_dashboard"]
-    
-    # Check if we have a valid dashboard response
-    if dashboard_data and "dashboard" in dashboard_data:
-        dashboard = dashboard_data.get("dashboard", {})
-        metrics = dashboard.get("metrics", {})
-        
-        # Critical Deviations Section
-        st.markdown("---")
-        st.subheader("🚨 Critical Deviations Flagged")
-        
-        critical_deviations = dashboard.get("critical_deviations", [])
-        if critical_deviations:
-            for i, deviation in enumerate(critical_deviations[:5]):  # Show top 5
-                analysis = deviation.get('analysis', {})
-                with st.expander(f"🚩 Critical Deviation {i+1} - {analysis.get('risk_level', 'Unknown').upper()}"):
-                    st.write(f"**Source:** {deviation.get('source_file', 'Unknown')}")
-                    st.write(f"**Content:** {deviation.get('content', 'No content')}")
-                    st.write(f"**Risk Level:** {analysis.get('risk_level', 'Unknown')}")
-                    st.write(f"**Affected Areas:** {', '.join(analysis.get('affected_areas', []))}")
-                    st.write("**Recommended Actions:**")
-                    for action in analysis.get('recommended_actions', []):
-                        st.write(f"• {action}")
-        else:
-            st.success("✅ No critical deviations flagged")
-        
-        # Compliance Trends Section
-        st.markdown("---")
-        st.subheader("📈 Non-Compliance Trends")
-        
-        compliance_trends = dashboard.get("compliance_trends", [])
-        if compliance_trends:
-            for i, trend in enumerate(compliance_trends[:3]):  # Show top 3
-                analysis = trend.get('analysis', {})
-                with st.expander(f"📊 Trend {i+1}: {analysis.get('trend_type', 'Unknown').title()}"):
-                    st.write(f"**Pattern:** {trend.get('pattern', 'Unknown')}")
-                    st.write(f"**Severity:** {analysis.get('severity', 'Unknown')}")
-                    st.write(f"**Recurrence:** {analysis.get('recurrence_frequency', 'Unknown')}")
-                    st.write(f"**Root Cause:** {analysis.get('root_cause_pattern', 'Unknown')}")
-                    st.write(f"**Departments Affected:** {', '.join(analysis.get('departments_affected', []))}")
-                    st.write("**Preventive Measures:**")
-                    for measure in analysis.get('preventive_measures', []):
-                        st.write(f"• {measure}")
-        else:
-            st.info("No significant compliance trends identified")
-        
-        # Recommendations Section
-        st.markdown("---")
-        st.subheader("🎯 Actionable Recommendations")
-        
-        recommendations = dashboard.get("recommendations", {})
-        if recommendations:
-            col1, col2 = st.columns(2)
-            
-            with col1:
-                st.write("**🚀 Immediate Actions**")
-                for action in recommendations.get('immediate_actions', []):
-                    st.write(f"• {action}")
-                
-                st.write("**🎓 Training Priorities**")
-                for priority in recommendations.get('training_priorities', []):
-                    st.write(f"• {priority}")
-            
-            with col2:
-                st.write("**🛡️ Preventive Measures**")
-                for measure in recommendations.get('preventive_measures', []):
-                    st.write(f"• {measure}")
-                
-                st.write("**⚙️ System Improvements**")
-                for improvement in recommendations.get('system_improvements', []):
-                    st.write(f"• {improvement}")
-        else:
-            st.info("No specific recommendations available")
-    
-    else:
-        st.error("❌ Failed to generate dashboard data")
-        if dashboard_data and "error" in dashboard_data:
-            st.error(f"Error: {dashboard_data['error']}")
-    # else:
-    #     st.info("Click 'Generate Dashboard' to see compliance analytics")
-        
-    #     # Quick actions
-    #     col1, col2 = st.columns(2)
-        
-    #     with col1:
-    #         if st.button("🚩 Check Critical Deviations", use_container_width=True, key="check_critical_btn"):
-    #             with st.spinner("Checking for critical issues..."):
-    #                 success, critical_data = get_critical_deviations()
-    #                 if success:
-    #                     st.session_state["critical_deviations_quick"] = critical_data
-    #                     st.rerun()
-        
-    #     with col2:
-    #         if st.button("📈 Quick Trends Analysis", use_container_width=True, key="quick_trends_btn"):
-    #             with st.spinner("Analyzing trends..."):
-    #                 success, trends_data = get_compliance_trends()
-    #                 if success:
-    #                     st.session_state["compliance_trends_quick"] = trends_data
-    #                     st.rerun()
-
+import os
+import time
+import atexit
+import asyncio
+import threading
+import streamlit as st
+import requests
+from requests.adapters import HTTPAdapter, Retry
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from functools import lru_cache
+from string import Template
+
+try:
+    import orjson
+except ImportError:  # optional speedup; stdlib json via requests otherwise
+    orjson = None
+
+try:
+    import httpx
+except ImportError:  # optional; falls back to the pooled requests session
+    httpx = None
+
+# ---------------------------
+# Page Configuration & Styling
+# ---------------------------
+st.set_page_config(
+    page_title="AI Lab Compliance Copilot",
+    page_icon="🧪",
+    layout="wide",
+    initial_sidebar_state="expanded",
+)
+
+_CSS = """
+    <style>
+        .stApp, body { background-color: #f3f4f6; }
+        .block-container { padding-top: 1.5rem; padding-bottom: 2rem; }
+
+        div[data-testid="stChatMessage"] {
+            background: #ffffff !important;
+            border: 1px solid #e5e7eb !important;
+            border-radius: 16px !important;
+            padding: 12px 14px !important;
+            margin-bottom: 10px !important;
+        }
+        div[data-testid="stChatMessage"] p {
+            color: #111827 !important;
+            font-size: 1rem !important;
+            line-height: 1.45 !important;
+        }
+
+        div[data-testid="stChatMessage"] > div:first-child {
+            background-color: #dbeafe !important;
+            border-radius: 50% !important;
+            border: 2px solid #3b82f6 !important;
+            padding: 2px !important;
+        }
+
+        div[data-testid="stChatMessage"][data-kind="user"] > div:first-child {
+            background-color: #dbeafe !important;
+            border: 2px solid #3b82f6 !important;
+        }
+
+        div[data-testid="stChatMessage"][data-kind="assistant"] > div:first-child {
+            background-color: #dcfce7 !important;
+            border: 2px solid #22c55e !important;
+        }
+
+        .stTextArea textarea {
+            background: #ffffff !important;
+            border: 1px solid #e5e7eb !important;
+            border-radius: 12px !important;
+            color: #111827 !important;
+        }
+
+        button[kind="primary"] {
+            background-color: #2563eb !important;
+            color: white !important;
+            border-radius: 10px !important;
+            height: 42px !important;
+            padding: 0 18px !important;
+            font-weight: 600 !important;
+            border: 1px solid #1d4ed8 !important;
+        }
+
+        h1, h2, h3, h4 { color: #111827 !important; }
+
+        .card {
+            border: 1px solid #e5e7eb;
+            background: #ffffff;
+            border-radius: 16px;
+            padding: 14px 16px;
+            margin-bottom: 10px;
+        }
+        
+        .deviation-card {
+            border: 1px solid #e5e7eb;
+            background: #ffffff;
+            border-radius: 12px;
+            padding: 16px;
+            margin-bottom: 12px;
+            box-shadow: 0 2px 4px rgba(0,0,0,0.05);
+        }
+        
+        .critical { border-left: 4px solid #ef4444; }
+        .major { border-left: 4px solid #f59e0b; }
+        .minor { border-left: 4px solid #10b981; }
+        
+        .download-btn {
+            background-color: #10b981 !important;
+            color: white !important;
+            border: none !important;
+            border-radius: 8px !important;
+            padding: 6px 12px !important;
+            font-size: 0.8rem !important;
+        }
+        
+        .sample-question {
+            background: #f8fafc !important;
+            border: 1px solid #e2e8f0 !important;
+            border-radius: 8px !important;
+            padding: 8px 12px !important;
+            margin: 4px 0 !important;
+            cursor: pointer !important;
+            transition: all 0.2s !important;
+        }
+        
+        .sample-question:hover {
+            background: #e2e8f0 !important;
+            border-color: #cbd5e1 !important;
+        }
+        
+        .sop-reference {
+            font-size: 0.8rem;
+            color: #6b7280;
+            font-style: italic;
+            margin-top: 8px;
+            padding: 4px 8px;
+            background: #f3f4f6;
+            border-radius: 4px;
+        }
+        
+        .alert-critical {
+            background: #fef2f2 !important;
+            border: 1px solid #fecaca !important;
+            border-left: 4px solid #ef4444 !important;
+        }
+        
+        .alert-warning {
+            background: #fffbeb !important;
+            border: 1px solid #fed7aa !important;
+            border-left: 4px solid #f59e0b !important;
+        }
+    </style>
+"""
+
+@st.cache_resource
+def _load_css():
+    return _CSS
+
+st.markdown(_load_css(), unsafe_allow_html=True)
+
+# ---------------------------
+# Backend URL Configuration
+# ---------------------------
+BACKEND_URL = "http://localhost:8000"
+
+# Shared keep-alive session so helper calls reuse pooled TCP connections
+# instead of opening a fresh one per request.
+if httpx is not None:
+    _REQUEST_TIMEOUT = httpx.Timeout(30.0, connect=3.0)
+    # The LLM-backed analysis endpoints can legitimately run for minutes on a
+    # cold cache (the backend allows 60 s per Groq call and chains several),
+    # so they keep the fast connect timeout but get a generous read window.
+    _ANALYSIS_TIMEOUT = httpx.Timeout(180.0, connect=3.0)
+else:
+    _REQUEST_TIMEOUT = (3, 30)  # (connect, read) seconds
+    _ANALYSIS_TIMEOUT = (3, 180)
+
+@st.cache_resource
+def get_http_session():
+    """Build the shared client once for the process lifetime"""
+    if httpx is not None:
+        try:
+            import h2  # noqa: F401
+            http2 = True
+        except ImportError:
+            http2 = False
+        transport = httpx.HTTPTransport(
+            retries=3,
+            limits=httpx.Limits(max_connections=50, max_keepalive_connections=20),
+        )
+        client = httpx.Client(
+            http2=http2,
+            transport=transport,
+            timeout=httpx.Timeout(30.0, connect=3.0),
+        )
+        atexit.register(client.close)
+        return client
+
+    session = requests.Session()
+    adapter = HTTPAdapter(
+        pool_connections=20,
+        pool_maxsize=50,
+        max_retries=Retry(total=3, backoff_factor=0.2),
+    )
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    session.headers["Connection"] = "keep-alive"
+    atexit.register(session.close)
+    return session
+
+SESSION = get_http_session()
+
+_CARD_TPL = Template(
+    '<div class="deviation-card $severity">'
+    '<strong>$preview</strong><br>'
+    '<small>Severity: $severity_upper | Category: $category</small>'
+    '</div>'
+)
+
+@lru_cache(maxsize=128)
+def _render_card(preview, severity, category):
+    """Format one deviation card; memoized so reruns reuse the HTML"""
+    return _CARD_TPL.substitute(
+        severity=severity,
+        preview=preview,
+        severity_upper=severity.upper(),
+        category=category,
+    )
+
+# Static tab-3 list, joined once at import so each rerun emits one element
+_TRAINING_NEEDS_MD = "\n".join(f"- {need}" for need in (
+    "Good Documentation Practices (GDP)",
+    "Equipment Operation & Maintenance",
+    "Environmental Monitoring Procedures",
+    "Deviation Reporting & Investigation",
+    "Root Cause Analysis Techniques",
+    "GMP Compliance Awareness",
+    "Quality Control Testing Methods",
+    "Batch Record Documentation",
+))
+
+@lru_cache(maxsize=256)
+def _join(items):
+    """Memoized comma join for the small tuples rendered every rerun"""
+    return ", ".join(items)
+
+def _bullets(items):
+    """Join list items into one markdown bullet block"""
+    return "\n".join(f"- {item}" for item in items)
+
+SAMPLE_QUESTIONS = (
+    "What is the compression machine pressure limit?",
+    "How to clean a vibro sifter?",
+    "What are the environmental monitoring requirements?",
+    "Procedure for handling deviations",
+    "Temperature limits for fluid bed dryer",
+    "Documentation requirements for batch manufacturing",
+    "Sampling frequency for in-process checks",
+    "Calibration procedure for balances",
+    "Cleaning validation requirements",
+    "Personnel training requirements",
+)
+
+# ---------------------------
+# Session State Initialization
+# ---------------------------
+_DEFAULTS = {
+    "history": [],
+    "clear_input": False,
+    "deviation_reports": [],
+    "trends_data": None,
+    "available_sops": [],
+    "current_query": "",
+    "query_submitted": False,
+    "critical_deviations": None,
+    "compliance_trends": None,
+    "compliance_dashboard": None,
+    "recent_alerts": None,
+}
+
+for _key, _default in _DEFAULTS.items():
+    if _key not in st.session_state:
+        # copy mutable defaults so sessions don't share the module-level lists
+        st.session_state[_key] = list(_default) if isinstance(_default, list) else _default
+
+# ---------------------------
+# Utility Functions
+# ---------------------------
+def _json(response):
+    """Decode a response body, with orjson when available"""
+    if orjson is not None:
+        return orjson.loads(response.content)
+    return response.json()
+
+# Coalesce identical GETs fired in quick succession (e.g. "Flag Critical"
+# and "Quick Scan" both hitting /flag-critical-deviations) into one fetch.
+_COALESCE_TTL = 2.0
+_coalesce_lock = threading.Lock()
+_coalesce_cache = {}
+_inflight_locks = {}
+
+def _coalesced_get(path):
+    """Serve repeated identical GETs within a short window from one fetch"""
+    with _coalesce_lock:
+        hit = _coalesce_cache.get(path)
+        if hit and time.monotonic() - hit[0] < _COALESCE_TTL:
+            return hit[1]
+        lock = _inflight_locks.setdefault(path, threading.Lock())
+
+    with lock:
+        # A concurrent caller may have fetched while we waited
+        with _coalesce_lock:
+            hit = _coalesce_cache.get(path)
+            if hit and time.monotonic() - hit[0] < _COALESCE_TTL:
+                return hit[1]
+
+        response = SESSION.get(f"{BACKEND_URL}{path}", timeout=_REQUEST_TIMEOUT)
+        result = (response.status_code == 200, _json(response) if response.status_code == 200 else None)
+        with _coalesce_lock:
+            _coalesce_cache[path] = (time.monotonic(), result)
+        return result
+
+@st.cache_data(ttl=30, show_spinner=False)
+def check_backend_health(nonce=0):
+    """Check if backend is running"""
+    try:
+        response = SESSION.get(f"{BACKEND_URL}/health", timeout=1.5)
+        return response.status_code == 200, _json(response) if response.status_code == 200 else None
+    except:
+        return False, None
+
+def upload_sop_file(file):
+    """Upload SOP file to backend"""
+    try:
+        files = {"file": (file.name, file.getvalue(), "application/pdf")}
+        response = SESSION.post(f"{BACKEND_URL}/upload-sop", files=files, timeout=_REQUEST_TIMEOUT)
+        return response.status_code == 200, _json(response) if response.status_code == 200 else None
+    except Exception as e:
+        return False, f"Connection error: {e}"
+
+@st.cache_data(ttl=60, show_spinner=False)
+def list_sops(nonce=0):
+    """Get list of available SOPs from backend"""
+    try:
+        response = SESSION.get(f"{BACKEND_URL}/list-sops", timeout=_REQUEST_TIMEOUT)
+        return response.status_code == 200, _json(response) if response.status_code == 200 else None
+    except Exception as e:
+        return False, f"Connection error: {e}"
+
+def process_sops():
+    """Process SOPs in backend"""
+    try:
+        response = SESSION.post(f"{BACKEND_URL}/process", timeout=_ANALYSIS_TIMEOUT)
+        return response.status_code == 200, _json(response) if response.status_code == 200 else None
+    except Exception as e:
+        return False, f"Connection error: {e}"
+
+def process_deviation_samples():
+    """Process deviation samples in backend"""
+    try:
+        response = SESSION.post(f"{BACKEND_URL}/process-deviations", timeout=_REQUEST_TIMEOUT)
+        return response.status_code == 200, _json(response) if response.status_code == 200 else None
+    except Exception as e:
+        return False, f"Connection error: {e}"
+
+def query_sop(query):
+    """Query SOP system"""
+    try:
+        response = SESSION.post(f"{BACKEND_URL}/query", data={"query": query}, timeout=_REQUEST_TIMEOUT)
+        return response.status_code == 200, _json(response) if response.status_code == 200 else None
+    except Exception as e:
+        return False, f"Connection error: {e}"
+
+def process_incident(incident_description, generate_pdf=True):
+    """Report incident to backend"""
+    try:
+        response = SESSION.post(
+            f"{BACKEND_URL}/report-incident",
+            data={"incident": incident_description, "generate_pdf": generate_pdf},
+            timeout=_REQUEST_TIMEOUT
+        )
+        return response.status_code == 200, _json(response) if response.status_code == 200 else None
+    except Exception as e:
+        return False, f"Connection error: {e}"
+
+@st.cache_data(ttl=120, show_spinner=False)
+def get_deviation_trends(days=30, nonce=0):
+    """Get deviation trends from backend"""
+    try:
+        response = SESSION.get(f"{BACKEND_URL}/deviation-trends?days={days}", timeout=_ANALYSIS_TIMEOUT)
+        return response.status_code == 200, _json(response) if response.status_code == 200 else None
+    except Exception as e:
+        return False, f"Connection error: {e}"
+
+@st.cache_data(ttl=120, show_spinner=False)
+def get_retraining_suggestions(nonce=0):
+    """Get retraining suggestions from backend"""
+    try:
+        response = SESSION.get(f"{BACKEND_URL}/retraining-suggestions", timeout=_ANALYSIS_TIMEOUT)
+        return response.status_code == 200, _json(response) if response.status_code == 200 else None
+    except Exception as e:
+        return False, f"Connection error: {e}"
+
+def create_structured_deviation(incident_description, severity, category, generate_pdf=True):
+    """Create structured deviation report"""
+    try:
+        response = SESSION.post(
+            f"{BACKEND_URL}/deviation-prompt",
+            data={
+                "incident_description": incident_description,
+                "severity": severity,
+                "category": category,
+                "generate_pdf": generate_pdf
+            },
+            timeout=_REQUEST_TIMEOUT
+        )
+        return response.status_code == 200, _json(response) if response.status_code == 200 else None
+    except Exception as e:
+        return False, f"Connection error: {e}"
+
+@st.cache_data(ttl=60, show_spinner=False)
+def list_reports(nonce=0):
+    """List all generated reports"""
+    try:
+        response = SESSION.get(f"{BACKEND_URL}/list-reports", timeout=_REQUEST_TIMEOUT)
+        return response.status_code == 200, _json(response) if response.status_code == 200 else None
+    except Exception as e:
+        return False, f"Connection error: {e}"
+
+@st.cache_data(ttl=120, show_spinner=False)
+def get_critical_deviations(nonce=0):
+    """Get flagged critical deviations"""
+    try:
+        return _coalesced_get("/flag-critical-deviations")
+    except Exception as e:
+        return False, f"Connection error: {e}"
+
+@st.cache_data(ttl=120, show_spinner=False)
+def get_compliance_trends(nonce=0):
+    """Get non-compliance trends"""
+    try:
+        return _coalesced_get("/compliance-trends")
+    except Exception as e:
+        return False, f"Connection error: {e}"
+
+@st.cache_data(ttl=120, show_spinner=False)
+def get_compliance_dashboard(nonce=0):
+    """Get comprehensive compliance dashboard"""
+    try:
+        response = SESSION.get(f"{BACKEND_URL}/compliance-dashboard", timeout=_ANALYSIS_TIMEOUT)
+        return response.status_code == 200, _json(response) if response.status_code == 200 else None
+    except Exception as e:
+        return False, f"Connection error: {e}"
+
+@st.cache_data(ttl=120, show_spinner=False)
+def get_tab4_bundle(days=30, nonce=0):
+    """Get the aggregated dashboard bundle in a single request"""
+    try:
+        response = SESSION.get(f"{BACKEND_URL}/compliance-bundle?days={days}", timeout=_ANALYSIS_TIMEOUT)
+        return response.status_code == 200, _json(response) if response.status_code == 200 else None
+    except Exception as e:
+        return False, f"Connection error: {e}"
+
+@st.cache_data(ttl=15, show_spinner=False)
+def get_real_time_alerts(nonce=0):
+    """Get real-time compliance alerts"""
+    try:
+        response = SESSION.get(f"{BACKEND_URL}/real-time-alerts", timeout=_REQUEST_TIMEOUT)
+        return response.status_code == 200, _json(response) if response.status_code == 200 else None
+    except Exception as e:
+        return False, f"Connection error: {e}"
+
+def set_sample_question(question):
+    """Set sample question in query input and queue it for submission"""
+    st.session_state["current_query"] = question
+    st.session_state["query_submitted"] = True
+
+def _sample_chosen():
+    """Radio on_change callback; Streamlit reruns once on its own after it"""
+    chosen = st.session_state.get("sample_q_radio")
+    if chosen and chosen != st.session_state.get("_last_sample"):
+        st.session_state["_last_sample"] = chosen
+        set_sample_question(chosen)
+
+def refresh_all():
+    """Fetch critical deviations, trends and alerts concurrently"""
+    nonce = time.time()
+    with ThreadPoolExecutor(max_workers=3) as executor:
+        critical = executor.submit(get_critical_deviations, nonce=nonce)
+        trends = executor.submit(get_compliance_trends, nonce=nonce)
+        alerts = executor.submit(get_real_time_alerts, nonce=nonce)
+        return critical.result(), trends.result(), alerts.result()
+
+async def _load_all(nonce):
+    """Fetch the four dashboard data sets concurrently"""
+    return await asyncio.gather(
+        asyncio.to_thread(get_compliance_dashboard, nonce=nonce),
+        asyncio.to_thread(get_critical_deviations, nonce=nonce),
+        asyncio.to_thread(get_deviation_trends, 30, nonce=nonce),
+        asyncio.to_thread(get_retraining_suggestions, nonce=nonce),
+    )
+
+@st.cache_resource
+def _get_executor():
+    """Background pool for non-blocking fetches"""
+    return ThreadPoolExecutor(max_workers=4)
+
+def load_dashboard_bundle():
+    """Refresh everything tab4 depends on with one aggregate request"""
+    success, bundle = get_tab4_bundle(nonce=time.time())
+    if success and isinstance(bundle, dict):
+        return (
+            (True, bundle.get("dashboard")),
+            (True, bundle.get("critical")),
+            (True, bundle.get("trends")),
+            (True, bundle.get("retraining")),
+        )
+    # Backend without /compliance-bundle: fall back to four concurrent calls
+    return asyncio.run(_load_all(time.time()))
+
+@dataclass(slots=True, frozen=True)
+class Deviation:
+    """One critical deviation row from the dashboard payload"""
+    source_file: str
+    content: str
+    risk_level: str
+    affected_areas: tuple
+    recommended_actions: tuple
+
+@dataclass(slots=True, frozen=True)
+class Trend:
+    """One non-compliance trend row from the dashboard payload"""
+    pattern: str
+    trend_type: str
+    severity: str
+    recurrence: str
+    root_cause: str
+    departments: tuple
+    preventive_measures: tuple
+
+def _normalize_dashboard(dashboard):
+    """Parse the dashboard lists into typed rows"""
+    deviations = tuple(
+        Deviation(
+            source_file=d.get('source_file', 'Unknown'),
+            content=d.get('content', 'No content'),
+            risk_level=(d.get('analysis') or {}).get('risk_level', 'Unknown'),
+            affected_areas=tuple((d.get('analysis') or {}).get('affected_areas', ())),
+            recommended_actions=tuple((d.get('analysis') or {}).get('recommended_actions', ())),
+        )
+        for d in dashboard.get("critical_deviations", [])
+    )
+    trends = tuple(
+        Trend(
+            pattern=t.get('pattern', 'Unknown'),
+            trend_type=(t.get('analysis') or {}).get('trend_type', 'Unknown'),
+            severity=(t.get('analysis') or {}).get('severity', 'Unknown'),
+            recurrence=(t.get('analysis') or {}).get('recurrence_frequency', 'Unknown'),
+            root_cause=(t.get('analysis') or {}).get('root_cause_pattern', 'Unknown'),
+            departments=tuple((t.get('analysis') or {}).get('departments_affected', ())),
+            preventive_measures=tuple((t.get('analysis') or {}).get('preventive_measures', ())),
+        )
+        for t in dashboard.get("compliance_trends", [])
+    )
+    return deviations, trends
+
+# Keyed on payload identity: the dict lives in session state between reruns,
+# so the same object means the same parse result. The cached payload is kept
+# alongside the rows and compared with `is` — id() alone is unsafe because a
+# replaced payload's address can be reused by the next one after GC.
+_normalize_cache = {}
+
+def _normalized(dashboard):
+    """Normalize a dashboard payload once and reuse it across reruns"""
+    key = id(dashboard)
+    hit = _normalize_cache.get(key)
+    if hit is None or hit[0] is not dashboard:
+        rows = _normalize_dashboard(dashboard)
+        if len(_normalize_cache) >= 8:
+            _normalize_cache.pop(next(iter(_normalize_cache)))
+        _normalize_cache[key] = hit = (dashboard, rows)
+    return hit[1]
+
+def _toggle_flag(flag):
+    """Flip a per-row session flag"""
+    st.session_state[flag] = not st.session_state.get(flag, False)
+
+def _paginate(key, items, page_size=5):
+    """Show one page of items with Prev/Next controls
+
+    Returns the visible window and its starting offset; the page index is
+    kept in session state under f"{key}_page".
+    """
+    total_pages = max(1, (len(items) + page_size - 1) // page_size)
+    page_key = f"{key}_page"
+    idx = min(st.session_state.setdefault(page_key, 0), total_pages - 1)
+
+    if total_pages > 1:
+        col_prev, col_info, col_next = st.columns([1, 2, 1])
+        if col_prev.button("◀ Prev", key=f"{key}_prev", disabled=idx == 0):
+            st.session_state[page_key] = idx - 1
+            st.rerun()
+        col_info.caption(f"Page {idx + 1} of {total_pages}")
+        if col_next.button("Next ▶", key=f"{key}_next", disabled=idx >= total_pages - 1):
+            st.session_state[page_key] = idx + 1
+            st.rerun()
+
+    start = idx * page_size
+    return items[start:start + page_size], start
+
+def run_sop_query(query):
+    """Query the backend and append the answer to chat history"""
+    with st.spinner("Searching SOP documents..."):
+        success, result = query_sop(query)
+
+    if success:
+        answer_text = result.get("answer", "No answer found.")
+        references = result.get("sop_references", [])
+
+        # Add to history
+        st.session_state["history"].append({
+            "q": query.strip(),
+            "a": answer_text,
+            "references": references
+        })
+
+        st.session_state["query_submitted"] = False
+        st.session_state["current_query"] = ""
+        st.rerun()
+    else:
+        st.error(f"Query failed: {result}")
+        st.session_state["query_submitted"] = False
+
+# ---------------------------
+# Sidebar Controls
+# ---------------------------
+@st.fragment(run_every=10)
+def health_badge():
+    """Poll backend health periodically, off the click path"""
+    backend_healthy, health_data = check_backend_health()
+    if backend_healthy:
+        if health_data:
+            st.caption(f"SOP Files: {health_data.get('sop_files_available', 0)}")
+            st.caption(f"Deviation Samples: {health_data.get('deviation_samples_available', 0)}")
+    else:
+        st.error("❌ Backend Not Connected")
+        st.caption("Make sure backend is running on localhost:8000")
+
+def _queue_action(name):
+    """Queue a sidebar action for the dispatcher"""
+    st.session_state["pending_action"] = name
+
+def _dispatch_pending_action():
+    """Run whichever action the last sidebar click queued"""
+    action = st.session_state.pop("pending_action", None)
+    if action is None:
+        return
+
+    if action == "check_alerts":
+        with st.spinner("Checking for critical deviations..."):
+            success, alerts = get_real_time_alerts(nonce=time.time())
+            if success and alerts.get('alerts_count', 0) > 0:
+                st.session_state["recent_alerts"] = alerts
+                st.warning(f"🚨 {alerts['alerts_count']} critical alerts found!")
+            else:
+                st.session_state["recent_alerts"] = None
+                st.success("✅ No critical alerts")
+
+    elif action == "refresh_sops":
+        success, sops_data = list_sops(nonce=time.time())
+        if success:
+            st.session_state["available_sops"] = sops_data.get("sops", [])
+            st.success(f"Found {len(st.session_state['available_sops'])} SOPs")
+        else:
+            st.error("Failed to load SOPs")
+
+    elif action == "process_sops":
+        with st.spinner("Embedding and processing SOP documents..."):
+            success, result = process_sops()
+            if success:
+                st.success("✅ SOPs processed successfully!")
+                # Refresh SOP list
+                success, sops_data = list_sops(nonce=time.time())
+                if success:
+                    st.session_state["available_sops"] = sops_data.get("sops", [])
+            else:
+                st.error(f"❌ Failed to process SOPs: {result}")
+
+    elif action == "process_deviations":
+        with st.spinner("Processing deviation samples for trend analysis..."):
+            success, result = process_deviation_samples()
+            if success:
+                st.success("✅ Deviation samples processed successfully!")
+            else:
+                st.error(f"❌ Failed to process deviations: {result}")
+
+    elif action == "flag_critical":
+        with st.spinner("Analyzing for critical deviations..."):
+            success, critical_data = get_critical_deviations(nonce=time.time())
+            if success:
+                st.session_state["critical_deviations"] = critical_data
+                flagged_count = critical_data.get('flagged_count', 0)
+                if flagged_count > 0:
+                    st.warning(f"🚩 {flagged_count} critical deviations!")
+                else:
+                    st.success("✅ No critical issues")
+                # Sidebar runs as a fragment, so propagate the new state
+                # to the main body explicitly.
+                st.rerun(scope="app")
+            else:
+                st.error("Failed to flag deviations")
+
+    elif action == "find_trends":
+        with st.spinner("Analyzing non-compliance patterns..."):
+            success, trends_data = get_compliance_trends(nonce=time.time())
+            if success:
+                st.session_state["compliance_trends"] = trends_data
+                trends_count = trends_data.get('trends_identified', 0)
+                if trends_count > 0:
+                    st.info(f"📈 {trends_count} trends found")
+                else:
+                    st.success("✅ No significant trends")
+                st.rerun(scope="app")
+            else:
+                st.error("Failed to analyze trends")
+
+    elif action == "generate_dashboard":
+        with st.spinner("Generating compliance dashboard..."):
+            success, dashboard_data = get_compliance_dashboard(nonce=time.time())
+            if success:
+                st.session_state["compliance_dashboard"] = dashboard_data
+                st.success("✅ Dashboard generated!")
+                st.rerun(scope="app")
+            else:
+                st.error("Failed to generate dashboard")
+
+    elif action == "refresh_reports":
+        success, reports = list_reports(nonce=time.time())
+        if success:
+            st.session_state["available_reports"] = reports
+            st.success("Reports refreshed!")
+        else:
+            st.error("Failed to load reports")
+
+    elif action == "quick_scan":
+        with st.spinner("Quick scanning for issues..."):
+            (success, critical_data), (trends_ok, trends_data), (alerts_ok, alerts_data) = refresh_all()
+            if trends_ok:
+                st.session_state["compliance_trends"] = trends_data
+            if alerts_ok and alerts_data.get('alerts_count', 0) > 0:
+                st.session_state["recent_alerts"] = alerts_data
+            if success:
+                st.session_state["critical_deviations"] = critical_data
+                flagged_count = critical_data.get('flagged_count', 0)
+                if flagged_count > 0:
+                    st.error(f"🚨 {flagged_count} critical issues!")
+                else:
+                    st.success("✅ System clean")
+            if success or trends_ok or alerts_ok:
+                st.rerun(scope="app")
+
+    elif action == "trends_only":
+        with st.spinner("Checking trends..."):
+            (crit_ok, critical_data), (success, trends_data), (alerts_ok, alerts_data) = refresh_all()
+            if crit_ok:
+                st.session_state["critical_deviations"] = critical_data
+            if alerts_ok and alerts_data.get('alerts_count', 0) > 0:
+                st.session_state["recent_alerts"] = alerts_data
+            if success:
+                st.session_state["compliance_trends"] = trends_data
+                trends_count = trends_data.get('trends_identified', 0)
+                if trends_count > 0:
+                    st.warning(f"📈 {trends_count} patterns found")
+                else:
+                    st.success("✅ No trends")
+            if success or crit_ok or alerts_ok:
+                st.rerun(scope="app")
+
+    elif action == "clear_all":
+        st.session_state["history"] = []
+        st.session_state["deviation_reports"] = []
+        st.session_state["critical_deviations"] = None
+        st.session_state["compliance_trends"] = None
+        st.session_state["compliance_dashboard"] = None
+        st.session_state["recent_alerts"] = None
+        st.session_state["current_query"] = ""
+        st.session_state["query_submitted"] = False
+        st.success("All session data cleared!")
+        st.rerun()
+
+@st.fragment
+def render_sidebar():
+    st.header("⚙️ Data & Settings")
+
+    # Clicks below only re-run this fragment; one dispatcher does the work
+    _dispatch_pending_action()
+
+    # Backend Health Check
+    health_badge()
+
+    # Real-time Alerts Section
+    st.markdown("---")
+    st.subheader("🚨 Real-time Alerts")
+
+    st.button("🔄 Check Alerts", use_container_width=True, key="check_alerts_btn",
+              on_click=_queue_action, args=("check_alerts",))
+
+    if "recent_alerts" in st.session_state and st.session_state["recent_alerts"]:
+        alerts_data = st.session_state["recent_alerts"]
+        for alert in alerts_data.get('alerts', [])[:3]:  # Show top 3
+            st.error(f"**{alert['title']}**")
+            st.caption(alert['description'][:100] + "...")
+
+    st.markdown("---")
+
+    # SOP Management
+    st.subheader("📚 SOP Management")
+
+    st.button("🔄 Refresh SOP List", use_container_width=True, key="refresh_sops_btn",
+              on_click=_queue_action, args=("refresh_sops",))
+
+    if st.session_state["available_sops"]:
+        st.write("**Available SOPs:**")
+        for sop in st.session_state["available_sops"][:5]:  # Show first 5
+            st.caption(f"• {sop}")
+
+    # SOP Upload
+    uploaded_pdf = st.file_uploader("📄 Upload New SOP PDF", type=["pdf"], key="pdf_up")
+    if uploaded_pdf is not None:
+        with st.spinner(f"Uploading {uploaded_pdf.name}..."):
+            success, result = upload_sop_file(uploaded_pdf)
+            if success:
+                st.success(f"✅ {uploaded_pdf.name} uploaded successfully!")
+                # Refresh SOP list
+                success, sops_data = list_sops(nonce=time.time())
+                if success:
+                    st.session_state["available_sops"] = sops_data.get("sops", [])
+            else:
+                st.error(f"❌ Upload failed: {result}")
+
+    # SOP Processing
+    st.button("📥 Process SOPs", use_container_width=True, key="process_sops_btn",
+              on_click=_queue_action, args=("process_sops",))
+
+    st.markdown("---")
+
+    # Deviation Analysis
+    st.subheader("📊 Deviation Analysis")
+
+    st.button("🔄 Process Deviation Samples", use_container_width=True, key="process_deviations_btn",
+              on_click=_queue_action, args=("process_deviations",))
+
+    # Enhanced Compliance Analysis Section
+    st.subheader("🚨 Compliance Monitoring")
+
+    col1, col2 = st.columns(2)
+
+    with col1:
+        st.button("🚩 Flag Critical", use_container_width=True, key="flag_deviations_btn",
+                  on_click=_queue_action, args=("flag_critical",))
+
+    with col2:
+        st.button("📈 Find Trends", use_container_width=True, key="find_trends_btn",
+                  on_click=_queue_action, args=("find_trends",))
+
+    st.button("📋 Generate Dashboard", use_container_width=True, key="generate_dashboard_btn",
+              on_click=_queue_action, args=("generate_dashboard",))
+
+    # Quick Status Display
+    if "critical_deviations" in st.session_state and st.session_state["critical_deviations"]:
+        critical_data = st.session_state["critical_deviations"]
+        flagged_count = critical_data.get('flagged_count', 0)
+        if flagged_count > 0:
+            st.error(f"**Active Critical Issues:** {flagged_count}")
+
+    if "compliance_trends" in st.session_state and st.session_state["compliance_trends"]:
+        trends_data = st.session_state["compliance_trends"]
+        trends_count = trends_data.get('trends_identified', 0)
+        if trends_count > 0:
+            st.warning(f"**Active Trends:** {trends_count}")
+
+    st.markdown("---")
+
+    # Report Management
+    st.subheader("📋 Reports")
+    st.button("🔄 Refresh Reports", use_container_width=True, key="refresh_reports_btn",
+              on_click=_queue_action, args=("refresh_reports",))
+
+    # Quick Actions
+    st.subheader("⚡ Quick Actions")
+
+    col1, col2 = st.columns(2)
+
+    with col1:
+        st.button("🔍 Quick Scan", use_container_width=True, key="quick_scan_btn",
+                  on_click=_queue_action, args=("quick_scan",))
+
+    with col2:
+        st.button("📊 Trends Only", use_container_width=True, key="trends_only_btn",
+                  on_click=_queue_action, args=("trends_only",))
+
+    # System Status
+    st.markdown("---")
+    st.subheader("🔍 System Status")
+
+    # Show current session state status
+    status_items = []
+
+    if st.session_state.get("available_sops"):
+        status_items.append(f"📚 SOPs: {len(st.session_state['available_sops'])}")
+
+    if st.session_state.get("deviation_reports"):
+        status_items.append(f"⚠️ Reports: {len(st.session_state['deviation_reports'])}")
+
+    if st.session_state.get("critical_deviations"):
+        critical_count = st.session_state["critical_deviations"].get('flagged_count', 0)
+        if critical_count > 0:
+            status_items.append(f"🚨 Critical: {critical_count}")
+
+    if st.session_state.get("compliance_trends"):
+        trends_count = st.session_state["compliance_trends"].get('trends_identified', 0)
+        if trends_count > 0:
+            status_items.append(f"📈 Trends: {trends_count}")
+
+    if status_items:
+        st.write("**Current Status:**")
+        for item in status_items:
+            st.caption(item)
+    else:
+        st.caption("No active analysis data")
+
+    # Clear All Data
+    st.markdown("---")
+    st.button("🗑️ Clear All Data", use_container_width=True, key="clear_all_btn",
+              on_click=_queue_action, args=("clear_all",))
+
+with st.sidebar:
+    render_sidebar()
+
+# ---------------------------
+# Main Layout
+# ---------------------------
+st.title("🧪 AI Lab Compliance Copilot")
+
+TAB_NAMES = ("💬 SOP Chat", "⚠️ Report Incident", "📈 Trends & Training", "📊 Compliance Dashboard")
+
+# st.tabs executes every tab body on every rerun; a selector plus guarded
+# dispatch below runs only the active view.
+active_tab = st.radio(
+    "View",
+    TAB_NAMES,
+    horizontal=True,
+    label_visibility="collapsed",
+    key="active_tab",
+)
+
+# ---------------------------
+# Tab 1: SOP Chat Interface
+# ---------------------------
+@st.fragment
+def chat_panel():
+    """Chat column; submits re-run only this fragment, not the whole page"""
+    st.subheader("Ask about SOPs")
+
+    # Display chat history
+    for turn in st.session_state["history"]:
+        with st.chat_message("user"):
+            st.write(turn["q"])
+        with st.chat_message("assistant"):
+            st.write(turn["a"])
+            # Show SOP references as subtle caption
+            if turn.get("references"):
+                st.markdown(f'<div class="sop-reference">Based on: {", ".join(turn["references"])}</div>', unsafe_allow_html=True)
+
+    # Handle query submission from sample questions
+    if st.session_state.get("query_submitted", False):
+        query = st.session_state["current_query"]
+        if query.strip():
+            run_sop_query(query)
+
+    # Chat input - use a different key for the widget
+    query_input = st.text_area(
+        "Ask a question about SOPs, procedures, or compliance...",
+        height=100,
+        label_visibility="collapsed",
+        key="query_input_widget",
+        value=st.session_state["current_query"],
+        placeholder="e.g., What is the temperature limit for FBD? What are the cleaning procedures for compression machines?"
+    )
+
+    col_btn1, col_btn2 = st.columns([1, 6])
+    with col_btn1:
+        ask_btn = st.button("Submit", type="primary", use_container_width=True, key="submit_query_btn")
+    with col_btn2:
+        clear_btn = st.button("Clear Chat", use_container_width=True, key="clear_chat_btn")
+
+    if clear_btn:
+        st.session_state["history"] = []
+        st.session_state["current_query"] = ""
+        st.session_state["query_submitted"] = False
+        st.rerun()
+
+    if ask_btn and query_input.strip():
+        # Query directly instead of flagging and rerunning first
+        run_sop_query(query_input)
+
+def render_chat_tab():
+    col1, col2 = st.columns([2, 1])
+
+    with col1:
+        chat_panel()
+
+    with col2:
+        st.subheader("Quick Actions")
+
+        st.markdown("---")
+        st.subheader("📋 Sample Questions")
+
+        st.radio(
+            "Sample Questions",
+            options=SAMPLE_QUESTIONS,
+            index=None,
+            label_visibility="collapsed",
+            key="sample_q_radio",
+            on_change=_sample_chosen
+        )
+
+# ---------------------------
+# Tab 2: Incident Reporting
+# ---------------------------
+@st.fragment
+def render_incident_tab():
+    col1, col2 = st.columns([1, 1])
+    
+    with col1:
+        st.subheader("📝 Report New Incident")
+            
+        with st.form("structured_incident_form"):
+            incident_desc = st.text_area("Incident Description:", 
+                                        key="structured_incident",
+                                        placeholder="Brief description of what happened")
+            
+            col1, col2 = st.columns(2)
+            with col1:
+                severity = st.selectbox("Severity Level:", 
+                                        ["minor", "major", "critical"],
+                                        key="severity_select")
+                category = st.selectbox("Category:",
+                                        ["equipment", "process", "documentation", "training", "environmental"],
+                                        key="category_select")
+            
+            with col2:
+                department = st.selectbox("Department:",
+                                        ["Manufacturing", "Quality Control", "Packaging", "Maintenance"],
+                                        key="dept_select")
+                generate_pdf = st.checkbox("Generate PDF Report", value=True, key="structured_pdf")
+            
+            submitted = st.form_submit_button("🚨 Create Deviation Report", type="primary", key="create_deviation_btn")
+            
+            if submitted and incident_desc.strip():
+                with st.spinner("Creating structured deviation report..."):
+                    success, result = create_structured_deviation(incident_desc, severity, category, generate_pdf)
+                    
+                    if success:
+                        st.success("✅ Deviation report created successfully!")
+                        if "report" in result:
+                            st.session_state["deviation_reports"].append(result)
+                            
+                            # Show download button for PDF
+                            report_data = result["report"]
+                            if report_data.get("pdf_report_path"):
+                                pdf_filename = os.path.basename(report_data["pdf_report_path"])
+                                st.link_button(
+                                    "📄 Download PDF Report",
+                                    f"{BACKEND_URL}/download-pdf/{pdf_filename}",
+                                    use_container_width=True
+                                )
+
+    with col2:
+        st.subheader("Recent Deviation Reports")
+        
+        if st.session_state["deviation_reports"]:
+            for report in st.session_state["deviation_reports"][-5:]:
+                deviation_data = report.get("deviation_analysis", {})
+                severity = deviation_data.get("severity_level", "unknown")
+                incident = report.get('incident', 'Unknown incident')
+                incident_preview = incident[:80] + "..." if len(incident) > 80 else incident
+
+                card = _render_card(incident_preview, severity, deviation_data.get('deviation_category', 'unknown'))
+                st.markdown(card, unsafe_allow_html=True)
+        else:
+            st.info("No deviation reports yet. Report an incident to see them here.")
+
+# ---------------------------
+# Tab 3: Trends & Training
+# ---------------------------
+@st.fragment
+def render_trends_tab():
+    col1, col2 = st.columns([1, 1])
+    
+    with col1:
+        st.subheader("📈 Deviation Trends & Flagging")
+        
+        # Quick flagging section
+        st.write("**🚨 Quick Flagging**")
+        
+        if st.button("🔍 Scan for Critical Issues", use_container_width=True, key="scan_critical_btn") \
+                and not st.session_state.get("scan_in_flight"):
+            # Guard against double-fires while a slow scan is already running
+            st.session_state["scan_in_flight"] = True
+            try:
+                with st.spinner("Scanning for critical deviations..."):
+                    success, critical_data = get_critical_deviations(nonce=time.time())
+                if success:
+                    flagged_count = critical_data.get('flagged_count', 0)
+                    if flagged_count > 0:
+                        st.error(f"🚨 {flagged_count} critical deviations found!")
+                        for deviation in critical_data.get('critical_deviations', [])[:3]:
+                            content = deviation.get('content', '')
+                            preview = deviation.get('preview') or (content[:100] + ("..." if len(content) > 100 else ""))
+                            st.write(f"• {preview}")
+                    else:
+                        st.success("✅ No critical issues found")
+            finally:
+                st.session_state["scan_in_flight"] = False
+        
+        # Display quick trends if available
+        if "compliance_trends_quick" in st.session_state:
+            trends_data = st.session_state["compliance_trends_quick"]
+            st.write("**📊 Quick Trends Analysis**")
+            for trend in trends_data.get('compliance_trends', [])[:2]:
+                st.write(f"• {trend.get('pattern', '')}: {trend.get('analysis', {}).get('severity', '')}")
+        
+        # Historical Trends Analysis
+        st.markdown("---")
+        st.subheader("📊 Historical Trends")
+        
+        if st.button("📈 Analyze Historical Trends", use_container_width=True, key="analyze_historical_btn") \
+                and not st.session_state.get("historical_in_flight"):
+            st.session_state["historical_in_flight"] = True
+            try:
+                with st.spinner("Analyzing historical deviation patterns..."):
+                    success, trends = get_deviation_trends(30, nonce=time.time())
+                    if success:
+                        st.session_state["trends_data"] = trends
+                        st.success("Trends analysis completed!")
+                    else:
+                        st.error("Failed to analyze trends")
+            finally:
+                st.session_state["historical_in_flight"] = False
+        
+        if st.session_state["trends_data"]:
+            trends = st.session_state["trends_data"]
+            if "error" not in trends:
+                st.success(f"✅ Analyzed {trends.get('reports_analyzed', 0)} reports")
+                
+                # Display trends analysis
+                st.write("**Trends Summary:**")
+                st.write(trends.get("trends_analysis", "No analysis available"))
+            else:
+                st.error(trends["error"])
+    
+    with col2:
+        st.subheader("🎓 Retraining & SOP Reinforcement")
+        
+        if st.button("🔄 Generate Training Suggestions", use_container_width=True, key="generate_training_btn") \
+                and not st.session_state.get("training_in_flight"):
+            st.session_state["training_in_flight"] = True
+            try:
+                with st.spinner("Analyzing deviations and generating training suggestions..."):
+                    success, suggestions = get_retraining_suggestions(nonce=time.time())
+                
+                    if success and "error" not in suggestions:
+                        st.success("✅ Training suggestions generated!")
+                    
+                        # Display suggestions
+                        st.write("**Comprehensive Training Program:**")
+                        st.write(suggestions.get("suggestions", "No specific suggestions available"))
+                    
+                        # Show program details
+                        if suggestions.get("program_id"):
+                            st.caption(f"Program ID: {suggestions['program_id']}")
+                    else:
+                        st.error("Failed to generate training suggestions")
+        
+            finally:
+                st.session_state["training_in_flight"] = False
+        
+        st.markdown("---")
+        st.subheader("📋 Common Training Needs")
+        
+        st.markdown(_TRAINING_NEEDS_MD)
+
+# ---------------------------
+# Tab 4: Compliance Dashboard
+# ---------------------------
+@st.fragment
+def render_dashboard_tab():
+    st.subheader("📊 Real-time Compliance Dashboard")
+    
+    col1, col2, col3, col4 = st.columns(4)
+    
+    with col1:
+        if st.button("🔄 Refresh Dashboard", use_container_width=True, key="refresh_dashboard_btn"):
+            # Submit instead of blocking so the rest of the UI stays usable
+            if "dash_future" not in st.session_state:
+                st.session_state["dash_future"] = _get_executor().submit(load_dashboard_bundle)
+
+    status_slot = st.empty()
+    fut = st.session_state.get("dash_future")
+    if fut is not None:
+        if fut.done():
+            (dash_ok, dashboard_data), (crit_ok, critical_data), (trends_ok, trends), (retrain_ok, suggestions) = fut.result()
+            del st.session_state["dash_future"]
+            if crit_ok:
+                st.session_state["critical_deviations"] = critical_data
+            if trends_ok:
+                st.session_state["trends_data"] = trends
+            if retrain_ok:
+                st.session_state["retraining_suggestions"] = suggestions
+            if dash_ok:
+                st.session_state["compliance_dashboard"] = dashboard_data
+        else:
+            status_slot.caption("⏳ Updating dashboard...")
+            time.sleep(0.5)
+            st.rerun(scope="fragment")
+    
+    # Display Dashboard Data
+    dashboard_data = st.session_state.get("compliance_dashboard")
+    if not dashboard_data:
+        st.info("No dashboard yet — click 🔄 Refresh Dashboard to load it")
+        return
+    if "dashboard" not in dashboard_data:
+        st.error("❌ Failed to generate dashboard data")
+        if "error" in dashboard_data:
+            st.error(f"Error: {dashboard_data['error']}")
+        return
+
+    dashboard = dashboard_data.get("dashboard", {})
+    metrics = dashboard.get("metrics", {})
+
+    # Critical Deviations Section
+    st.markdown("---")
+    st.subheader("🚨 Critical Deviations Flagged")
+
+    critical_rows, trend_rows = _normalized(dashboard)
+    if critical_rows:
+        page, offset = _paginate("critical_devs", critical_rows, page_size=5)
+        for i, deviation in enumerate(page):
+            row = offset + i
+            flag = f"critical_devs_open_{row}"
+            with st.expander(f"🚩 Critical Deviation {row+1} - {deviation.risk_level.upper()}"):
+                # Details only become widgets once asked for
+                if st.session_state.get(flag):
+                    st.markdown(
+                        f"**Source:** {deviation.source_file}\n\n"
+                        f"**Content:** {deviation.content}\n\n"
+                        f"**Risk Level:** {deviation.risk_level}\n\n"
+                        f"**Affected Areas:** {_join(deviation.affected_areas)}\n\n"
+                        "**Recommended Actions:**\n"
+                        + _bullets(deviation.recommended_actions)
+                    )
+                else:
+                    st.button("Show details", key=f"critical_devs_show_{row}",
+                              on_click=_toggle_flag, args=(flag,))
+    else:
+        st.success("✅ No critical deviations flagged")
+
+    # Compliance Trends Section
+    st.markdown("---")
+    st.subheader("📈 Non-Compliance Trends")
+
+    if trend_rows:
+        page, offset = _paginate("compliance_trends", trend_rows, page_size=3)
+        for i, trend in enumerate(page):
+            row = offset + i
+            flag = f"compliance_trends_open_{row}"
+            with st.expander(f"📊 Trend {row+1}: {trend.trend_type.title()}"):
+                if st.session_state.get(flag):
+                    st.markdown(
+                        f"**Pattern:** {trend.pattern}\n\n"
+                        f"**Severity:** {trend.severity}\n\n"
+                        f"**Recurrence:** {trend.recurrence}\n\n"
+                        f"**Root Cause:** {trend.root_cause}\n\n"
+                        f"**Departments Affected:** {_join(trend.departments)}\n\n"
+                        "**Preventive Measures:**\n"
+                        + _bullets(trend.preventive_measures)
+                    )
+                else:
+                    st.button("Show details", key=f"compliance_trends_show_{row}",
+                              on_click=_toggle_flag, args=(flag,))
+    else:
+        st.info("No significant compliance trends identified")
+
+    # Recommendations Section
+    st.markdown("---")
+    st.subheader("🎯 Actionable Recommendations")
+
+    recommendations = dashboard.get("recommendations", {})
+    if recommendations:
+        col1, col2 = st.columns(2)
+    
+        with col1:
+            st.write("**🚀 Immediate Actions**")
+            st.markdown(_bullets(recommendations.get('immediate_actions', [])))
+        
+            st.write("**🎓 Training Priorities**")
+            st.markdown(_bullets(recommendations.get('training_priorities', [])))
+    
+        with col2:
+            st.write("**🛡️ Preventive Measures**")
+            st.markdown(_bullets(recommendations.get('preventive_measures', [])))
+        
+            st.write("**⚙️ System Improvements**")
+            st.markdown(_bullets(recommendations.get('system_improvements', [])))
+    else:
+        st.info("No specific recommendations available")
+
+if active_tab == "⚠️ Report Incident":
+    render_incident_tab()
+elif active_tab == "📈 Trends & Training":
+    render_trends_tab()
+elif active_tab == "📊 Compliance Dashboard":
+    render_dashboard_tab()
+else:
+    render_chat_tab()